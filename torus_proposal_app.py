@@ -1,23 +1,75 @@
+from __future__ import annotations
+
 import os
+import re
+import copy
 import json
+import html
+import hashlib
 import datetime
+import time
+import shutil
+import subprocess
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable, Sequence, TYPE_CHECKING
 
 import streamlit as st
-import pandas as pd
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from pypdf import PdfReader
-from openai import OpenAI
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-import html
+# openai, python-docx, tiktoken and the PDF libraries are imported where they are used,
+# so the UI paints before their (slow) first import on a cold container
+if TYPE_CHECKING:
+    from docx import Document
+    from docx.text.paragraph import Paragraph
+    from openai import OpenAI
+
+try:
+    import orjson  # faster JSON encoding/parsing; the stdlib json module is the fallback
+except ImportError:
+    orjson = None
+
+# Both accept str or bytes
+json_loads = orjson.loads if orjson is not None else json.loads
 
 CHECK = "✓"
+CELL = ("", CHECK)  # schedule cell text, indexed by the frequency flag
+CELL_XML = ("", f"<w:t>{CHECK}</w:t>")
+P_XML = '<w:p xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">%s</w:p>'
+BULLET_P_XML = '<w:pPr><w:pStyle w:val="%s"/></w:pPr><w:r>%s</w:r>'
+SCHEDULE_COLUMNS = ("Task", "Daily", "Weekly", "Monthly")
 TEMPLATE_FILE = "Torus_Template.docx"
 
+DEFAULT_SCHEDULE_ROWS = (
+    ("Empty trash & replace liners", True, False, False),
+    ("Clean & disinfect restrooms", True, False, False),
+    ("Vacuum carpet / sweep hard floors", True, False, False),
+    ("Wipe high-touch points (handles, switches)", True, False, False),
+    ("Dust reachable surfaces", False, True, False),
+    ("Mop hard floors (as applicable)", False, True, False),
+    ("Clean break room counters & sink", False, True, False),
+    ("Glass/mirrors touch-up", False, True, False),
+    ("High dusting (vents/ledges)", False, False, True),
+    ("Detail baseboards/edges", False, False, True),
+)
+
+# Shared by the Word document and the print preview
+GENERAL_REQUIREMENTS_TEXT = (
+    "Contractor shall provide all labor, supervision, and personnel necessary to perform the services described in this agreement. "
+    "Unless otherwise stated, Contractor shall provide all standard equipment and cleaning supplies."
+)
+
+# Invoicing sentence per compensation basis, also shared by the document and the preview
+INVOICE_SENTENCES = {
+    "monthly": "The Client will be invoiced monthly in arrears.",
+    "annual": "The Client will be invoiced annually.",
+    "per visit": "The Client will be invoiced per visit upon completion of each visit.",
+    "one-time clean": "The Client will be invoiced upon completion of the Services.",
+}
+DEFAULT_INVOICE_SENTENCE = "The Client will be invoiced upon completion of the Services."
+PDFTOTEXT = shutil.which("pdftotext")  # Poppler binary; fastest PDF path when installed
+
 
 # =========================
 # DATA MODEL
@@ -73,6 +125,14 @@ class ProposalInputs:
     contractor_title: str
 
 
+def inputs_json(p: ProposalInputs, indent: bool = False, sort_keys: bool = False) -> bytes:
+    if orjson is not None:
+        # orjson serializes dataclasses natively, without the asdict() deep copy
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(p, option=option)
+    return json.dumps(asdict(p), indent=2 if indent else None, sort_keys=sort_keys).encode("utf-8")
+
+
 # =========================
 # DEFAULT COVER LETTER
 # =========================
@@ -96,57 +156,427 @@ Torus Cleaning Services
 # =========================
 # OPENAI (AI Analyzer)
 # =========================
+@st.cache_resource(show_spinner=False)
+def _openai_client(key: str) -> OpenAI:
+    from openai import OpenAI
+
+    # One client per key for the whole process, so its HTTP connection pool is reused across calls
+    return OpenAI(api_key=key)
+
+
 def get_openai_client() -> OpenAI:
     key = st.secrets.get("OPENAI_API_KEY")
     if not key:
         raise RuntimeError("Missing OPENAI_API_KEY in Streamlit secrets.")
-    return OpenAI(api_key=key)
+    return _openai_client(key)
 
 
-def analyze_rfp_with_ai(text: str) -> dict:
-    client = get_openai_client()
+# Kept byte-identical across calls: OpenAI prompt caching only matches exact prefixes
+RFP_INSTRUCTIONS = """
+Analyze each <doc> below as a janitorial RFP / PWS.
 
-    instructions = """
-Return ONLY valid JSON with this exact structure:
+Rules:
+- Return one entry in "documents" per <doc>, in the same order
+- 12–30 realistic janitorial tasks per document
+- Mark each task daily, weekly, or monthly
+
+RFP / PWS documents:
+"""
 
-{
-  "cleaning_plan_draft": "string",
-  "scope_of_work_draft": "string",
-  "schedule_rows": [
-    {"task": "string", "daily": true, "weekly": false, "monthly": false}
-  ],
-  "clarifying_questions": ["string"]
+_SCHEDULE_ROW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "task": {"type": "string"},
+        "daily": {"type": "boolean"},
+        "weekly": {"type": "boolean"},
+        "monthly": {"type": "boolean"},
+    },
+    "required": ["task", "daily", "weekly", "monthly"],
+    "additionalProperties": False,
 }
 
-Rules:
-- JSON only (no markdown, no explanation)
-- 12–30 realistic janitorial tasks
-"""
+_DOCUMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cleaning_plan_draft": {"type": "string"},
+        "scope_of_work_draft": {"type": "string"},
+        "schedule_rows": {"type": "array", "items": _SCHEDULE_ROW_SCHEMA},
+        "clarifying_questions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["cleaning_plan_draft", "scope_of_work_draft", "schedule_rows", "clarifying_questions"],
+    "additionalProperties": False,
+}
+
+# Strict structured output: the model emits exactly these fields, no prose or extra keys
+RFP_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "rfp_analysis",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"documents": {"type": "array", "items": _DOCUMENT_SCHEMA}},
+            "required": ["documents"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+# Unfinished batches are re-run synchronously after this long
+BATCH_FALLBACK_MINUTES = 120
+BATCH_PENDING_STATUSES = ("validating", "in_progress", "finalizing")
+
+AI_MODEL = "gpt-4o-mini"
+
+# Part of every analysis cache key: cached results from an older prompt, schema or model are not reused
+RFP_CACHE_VERSION = hashlib.sha256(
+    json.dumps([AI_MODEL, RFP_INSTRUCTIONS, RFP_RESPONSE_FORMAT], sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+# Documents answered per chat call; more than this bloats the context
+MAX_DOCS_PER_CALL = 8
+STREAM_UPDATE_CHUNKS = 20  # streamed chunks between on_delta progress callbacks
+
+# Default RFP budget per call, split across its documents (the char cap applies when tiktoken is unavailable)
+MAX_RFP_TOKENS = 30000
+MAX_RFP_CHARS = 120000
+CHARS_PER_TOKEN = MAX_RFP_CHARS // MAX_RFP_TOKENS
+MAX_RFP_TOKEN_BUDGET = 100000  # largest budget the analyzer lets users pick
+
+# "Page N" / "Page N of M" footer lines. Lone numbers and dates are kept: in RFPs they are
+# often room counts, quantities, square footage or due dates on their own line
+_PAGE_NOISE_RE = re.compile(r"^[ \t]*page[ \t]+\d+(?:[ \t]+of[ \t]+\d+)?[ \t]*$", re.I | re.M)
+
+
+def compact_rfp_text(text: str) -> str:
+    text = _PAGE_NOISE_RE.sub("", text)
+    text = re.sub(r"[ \t]{2,}", " ", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def prepare_rfp_texts(texts: List[str]) -> tuple:
+    """Drop empty and duplicate documents; return (texts, content key for the analysis cache)."""
+    unique, digests = [], []
+    for t in texts:
+        if not t.strip():
+            continue
+        # Only whitespace is normalized: any other difference (a count, a date) is a different RFP
+        d = hashlib.sha256(" ".join(t.split()).encode("utf-8")).hexdigest()
+        if d not in digests:
+            digests.append(d)
+            unique.append(t)
+    return unique, hashlib.sha256((RFP_CACHE_VERSION + "".join(digests)).encode("ascii")).hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def rfp_encoding():
+    # Token-accurate RFP truncation; tiktoken is imported on first use, not at startup.
+    # None (character cap fallback) when it isn't installed or its encoding files can't be fetched.
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(AI_MODEL)
+    except Exception:
+        return None
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def rfp_token_ids(text: str) -> List[int]:
+    # Shared between the token count shown in the analyzer and the truncation in the request,
+    # so each document is encoded once per Analyze. Callers must not modify the list.
+    return rfp_encoding().encode(text, disallowed_special=())
+
+
+def truncate_rfp_text(text: str, max_tokens: int, max_chars: int) -> str:
+    enc = rfp_encoding()
+    if enc is not None:
+        ids = rfp_token_ids(text)
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+    return text[:max_chars]
+
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": instructions},
-            {"role": "user", "content": text[:120000]},
+def rfp_token_count(texts: List[str]) -> Optional[int]:
+    """Tokens in the compacted RFP texts as extracted, before the budget cut; None without tiktoken."""
+    if rfp_encoding() is None:
+        return None
+    return sum(len(rfp_token_ids(compact_rfp_text(t))) for t in texts)
+
+
+def rfp_request_body(texts: Sequence[str], max_tokens: int = MAX_RFP_TOKENS) -> dict:
+    n = max(len(texts), 1)
+    docs = "".join(
+        f'<doc id="{i}">\n{truncate_rfp_text(compact_rfp_text(t), max_tokens // n, max_tokens * CHARS_PER_TOKEN // n)}\n</doc>\n'
+        for i, t in enumerate(texts, start=1)
+    )
+    # Instructions + RFP form one stable prefix, so re-analyzing the same RFP hits the prompt cache.
+    # The instructions alone are below the cache's minimum prefix length, so the routing key is
+    # per RFP: repeat requests for the same documents land where that prefix is already cached.
+    return {
+        "model": AI_MODEL,
+        "messages": [
+            {"role": "system", "content": RFP_INSTRUCTIONS + docs},
+            {"role": "user", "content": "Produce the JSON now."},
         ],
-        response_format={"type": "json_object"},
-        temperature=0.2,
+        "response_format": RFP_RESPONSE_FORMAT,
+        "temperature": 0.2,
+        "prompt_cache_key": "rfp-" + hashlib.sha256(docs.encode("utf-8")).hexdigest()[:32],
+    }
+
+
+def parse_ai_documents(content: str) -> List[dict]:
+    data = json_loads(content)
+    docs = data.get("documents")
+    return docs if isinstance(docs, list) else [data]
+
+
+def analyze_rfp_with_ai(
+    texts: Sequence[str], on_delta: Optional[Callable[[List[str]], None]] = None, max_tokens: int = MAX_RFP_TOKENS
+) -> dict:
+    # One call answers up to MAX_DOCS_PER_CALL documents instead of one round-trip per file;
+    # with more documents than that, the calls run concurrently.
+    # Responses are streamed; on_delta receives the JSON received so far, one string per call.
+    client = get_openai_client()
+    groups = [texts[i : i + MAX_DOCS_PER_CALL] for i in range(0, len(texts), MAX_DOCS_PER_CALL)]
+    parts: List[List[str]] = [[] for _ in groups]
+
+    def run(i: int) -> List[dict]:
+        stream = client.chat.completions.create(**rfp_request_body(groups[i], max_tokens), stream=True)
+        for n, chunk in enumerate(stream, 1):
+            if chunk.choices:
+                parts[i].append(chunk.choices[0].delta.content or "")
+                # Joining the buffers is O(response), so progress is reported every few chunks
+                if on_delta and n % STREAM_UPDATE_CHUNKS == 0:
+                    on_delta(["".join(p) for p in parts])
+        return parse_ai_documents("".join(parts[i]))
+
+    if len(groups) == 1:
+        results = run(0)
+    else:
+        with ThreadPoolExecutor(max_workers=len(groups)) as ex:
+            results = [doc for docs in ex.map(run, range(len(groups))) for doc in docs]
+    return merge_ai_results(results)
+
+
+def partial_ai_result(texts: List[str]) -> Optional[dict]:
+    # Best-effort merge of responses still being streamed; None until something parses
+    try:
+        import jiter  # installed with openai; tolerant parsing of truncated JSON
+    except ImportError:
+        return None
+    docs = []
+    for t in texts:
+        try:
+            data = jiter.from_json(t.encode("utf-8"), partial_mode="trailing-strings")
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            docs.extend(d for d in data.get("documents") or [] if isinstance(d, dict))
+    return merge_ai_results(docs) if docs else None
+
+
+def merge_ai_results(results: List[dict]) -> dict:
+    # Combine per-RFP analyses; schedule tasks and questions are de-duplicated case-insensitively
+    merged = {"cleaning_plan_draft": "", "scope_of_work_draft": "", "schedule_rows": [], "clarifying_questions": []}
+    seen_tasks, seen_questions = set(), set()
+    for r in results:
+        for field in ("cleaning_plan_draft", "scope_of_work_draft"):
+            part = (r.get(field) or "").strip()
+            if part:
+                merged[field] = f"{merged[field]}\n\n{part}" if merged[field] else part
+        for row in r.get("schedule_rows", []) or []:
+            key = (row.get("task") or "").strip().lower()
+            if key and key not in seen_tasks:
+                seen_tasks.add(key)
+                merged["schedule_rows"].append(row)
+        for q in r.get("clarifying_questions", []) or []:
+            key = str(q).strip().lower()
+            if key and key not in seen_questions:
+                seen_questions.add(key)
+                merged["clarifying_questions"].append(q)
+    return merged
+
+
+def submit_rfp_batch(texts: List[str], max_tokens: int = MAX_RFP_TOKENS) -> str:
+    """Queue one analysis per RFP on the Batch API (half price, done within 24h). Returns the batch id."""
+    client = get_openai_client()
+    lines = [
+        json.dumps({"custom_id": f"rfp-{i}", "method": "POST", "url": "/v1/chat/completions", "body": rfp_request_body([t], max_tokens)})
+        for i, t in enumerate(texts)
+    ]
+    batch_file = client.files.create(file=("rfp_batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
     )
-    return json.loads(resp.choices[0].message.content)
+    return batch.id
+
+
+def fetch_rfp_batch(batch_id: str) -> tuple:
+    """Return (status, merged analysis). The analysis is None until the batch has completed."""
+    client = get_openai_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        return batch.status, None
+
+    results = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        item = json_loads(line)
+        body = (item.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        if choices:
+            results[int(item["custom_id"].split("-")[1])] = parse_ai_documents(choices[0]["message"]["content"])
+    return batch.status, merge_ai_results([doc for i in sorted(results) for doc in results[i]])
+
+
+# On disk, so a re-upload of the same RFP is free even after the app restarts
+# (persisted caches ignore ttl; RFP_CACHE_VERSION in the key retires stale results)
+@st.cache_data(show_spinner=False, max_entries=32, persist="disk")
+def analyze_rfp_with_ai_cached(
+    key: str,
+    _texts: tuple,
+    _on_delta: Optional[Callable[[List[str]], None]] = None,
+    max_tokens: int = MAX_RFP_TOKENS,
+) -> dict:
+    # Keyed on the content hash from prepare_rfp_texts (plus the budget), so the large texts are never re-hashed.
+    # _on_delta must not call Streamlit: elements created inside a cached function get replayed on hits.
+    return analyze_rfp_with_ai(_texts, _on_delta, max_tokens)
 
 
 # =========================
 # FILE TEXT EXTRACTION
 # =========================
-def extract_text(uploaded_file) -> str:
-    name = (uploaded_file.name or "").lower()
-    data = uploaded_file.read()
+# Every PDF extractor stops here: twice the largest token budget in characters, so no budget the
+# analyzer allows is starved by extraction; the headroom covers what compact_rfp_text strips
+MAX_PDF_CHARS = 2 * MAX_RFP_TOKEN_BUDGET * CHARS_PER_TOKEN
+PYPDF_DEADLINE_SECONDS = 30  # total pypdf extraction time per file
+PDF_TIMEOUT_MARKER = "(remaining pages skipped: extraction timed out"
+
+
+def pdftotext_text(data: bytes) -> str:
+    # PDF on stdin, text on stdout: no temp file round-trip through the disk
+    out = subprocess.run(
+        [PDFTOTEXT, "-q", "-layout", "-nopgbrk", "-", "-"],
+        input=data,
+        capture_output=True,
+        timeout=60,
+        check=True,
+    )
+    return out.stdout.decode("utf-8", errors="ignore")[:MAX_PDF_CHARS].strip()
+
+
+def join_pdf_pages(pages) -> str:
+    # Pulls pages lazily, skipping blank ones and stopping once the character budget is reached
+    buf, total = [], 0
+    for text in pages:
+        if not text or text.isspace():
+            continue
+        buf.append(text)
+        total += len(text)
+        if total >= MAX_PDF_CHARS:
+            break
+    return "\n".join(buf).strip()
+
+
+def pypdf_page_texts(reader):
+    # pypdf can't be interrupted inside a page, so the deadline is checked between pages;
+    # a slow or pathological PDF returns what was read so far, plus a marker, instead of blocking Analyze
+    deadline = time.monotonic() + PYPDF_DEADLINE_SECONDS
+    pages = reader.pages
+    for i, page in enumerate(pages):
+        if time.monotonic() > deadline:
+            yield f"{PDF_TIMEOUT_MARKER} after page {i} of {len(pages)})"
+            break
+        yield page.extract_text(extraction_mode="plain")
+
+
+def extract_pdf_text(data: bytes) -> str:
+    if PDFTOTEXT:
+        try:
+            text = pdftotext_text(data)
+            if text:
+                return text
+        except (OSError, subprocess.SubprocessError):
+            pass  # fall back to the Python extractors below
+
+    try:
+        import pymupdf  # fast PDF text extraction; pypdf is the fallback
+    except ImportError:
+        pymupdf = None
+
+    if pymupdf is not None:
+        try:
+            with pymupdf.open(stream=data, filetype="pdf") as pdf:
+                return join_pdf_pages(page.get_text("text") for page in pdf)
+        except Exception:
+            pass  # fall back to pypdf below
+
+    from pypdf import PdfReader
+
+    reader = PdfReader(BytesIO(data), strict=False)
+    return join_pdf_pages(pypdf_page_texts(reader))
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+
+def extract_docx_text(data: bytes) -> str:
+    # Reads word/document.xml directly: one lxml parse and a single pass over the body,
+    # without building python-docx's part graph and Paragraph/Run objects.
+    # Table cells are included, one line per paragraph.
+    import zipfile
+
+    from lxml import etree
+
+    with zipfile.ZipFile(BytesIO(data)) as z:
+        xml = z.read("word/document.xml")
+    root = etree.fromstring(xml, etree.XMLParser(resolve_entities=False))
+    body = root.find(f"{_W}body")
+
+    # Text boxes are stored twice: in mc:Choice and again as a VML copy in mc:Fallback
+    for fallback in list(body.iter(f"{_MC}Fallback")):
+        fallback.getparent().remove(fallback)
+
+    # One frame per open paragraph: (its text parts, lines of paragraphs nested in it).
+    # A text box paragraph sits inside its anchor paragraph; its lines follow the anchor's
+    # line instead of splitting it.
+    lines: List[str] = []
+    stack: List[tuple] = []
+    for event, el in etree.iterwalk(body, events=("start", "end"), tag=(f"{_W}p", f"{_W}t", f"{_W}tab", f"{_W}br")):
+        if el.tag == f"{_W}p":
+            if event == "start":
+                stack.append(([], []))
+                continue
+            parts, nested = stack.pop()
+            out = (["".join(parts)] if parts else []) + nested
+            (stack[-1][1] if stack else lines).extend(out)
+        elif event == "end" or not stack:
+            continue
+        elif el.tag == f"{_W}t":
+            stack[-1][0].append(el.text or "")
+        elif el.getparent().tag == f"{_W}r":  # not the tab-stop definitions in w:pPr
+            stack[-1][0].append("\t" if el.tag == f"{_W}tab" else "\n")
+    return "\n".join(lines).strip()
+
+
+def extract_text_bytes(name: str, data: bytes) -> str:
+    name = (name or "").lower()
 
     if name.endswith(".pdf"):
-        reader = PdfReader(BytesIO(data))
-        return "\n".join((p.extract_text() or "") for p in reader.pages).strip()
+        return extract_pdf_text(data)
 
     if name.endswith(".docx"):
+        try:
+            return extract_docx_text(data)
+        except Exception:
+            pass  # fall back to python-docx below
+
+        from docx import Document
+
         doc = Document(BytesIO(data))
         return "\n".join(p.text for p in doc.paragraphs).strip()
 
@@ -156,86 +586,200 @@ def extract_text(uploaded_file) -> str:
         return ""
 
 
+def file_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl=3600)
+def extract_text_cached(name: str, digest: str, _data: bytes) -> str:
+    # Keyed on the content digest so Streamlit does not re-hash the whole upload on every lookup
+    return extract_text_bytes(name, _data)
+
+
+def script_thread_pool(max_workers: Optional[int] = None) -> ThreadPoolExecutor:
+    # Workers inherit the script run context so st.cache_data works inside them
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=lambda: add_script_run_ctx(ctx=ctx))
+
+
 # =========================
 # WORD HELPERS
 # =========================
-def add_heading(doc: Document, text: str):
-    p = doc.add_paragraph(text)
-    (p.runs[0] if p.runs else p.add_run(text)).bold = True
+# Content is inserted before an empty sentinel paragraph kept at the end of the body.
+# insert_paragraph_before is a single lxml addprevious, whereas Document.add_paragraph
+# searches the body for <w:sectPr> on every call.
+def _sentinel(doc: Document) -> Paragraph:
+    s = getattr(doc, "_torus_sentinel", None)
+    if s is None:
+        s = doc._torus_sentinel = doc.add_paragraph()
+    return s
+
+
+def _append_xml(doc: Document, inner: str) -> Paragraph:
+    # Parses the finished paragraph XML in one step instead of building runs through python-docx
+    from docx.oxml import parse_xml
+    from docx.text.paragraph import Paragraph
+
+    s = _sentinel(doc)
+    p = parse_xml(P_XML % inner)
+    s._p.addprevious(p)
+    return Paragraph(p, s._parent)
+
+
+def _has_breaks(text: str) -> bool:
+    # Tabs and line breaks need run markup; python-docx builds those
+    return "\t" in text or "\n" in text or "\r" in text
+
+
+def _append(doc: Document, text: str = "", style=None) -> Paragraph:
+    if style is not None or _has_breaks(text):
+        return _sentinel(doc).insert_paragraph_before(text, style)
+    return _append_xml(doc, f"<w:r>{_w_t(text)}</w:r>" if text else "")
+
+
+def _append_table(doc: Document, rows: int, cols: int):
+    table = doc.add_table(rows=rows, cols=cols)
+    _sentinel(doc)._p.addprevious(table._tbl)
+    return table
+
+
+def _append_page_break(doc: Document):
+    from docx.enum.text import WD_BREAK
+
+    _append(doc).add_run().add_break(WD_BREAK.PAGE)
+
+
+def _remove_sentinel(doc: Document):
+    s = getattr(doc, "_torus_sentinel", None)
+    if s is not None:
+        s._p.getparent().remove(s._p)
+        doc._torus_sentinel = None
+
+
+def _w_t(text: str) -> str:
+    if not text:
+        return ""
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f"<w:t{space}>{html.escape(text, quote=False)}</w:t>"
+
+
+def add_heading(doc: Document, text: str, align=None) -> Paragraph:
+    # Bold run written with the paragraph instead of fetched back through p.runs
+    if _has_breaks(text):
+        p = _append(doc)
+        p.add_run(text).bold = True
+    else:
+        p = _append_xml(doc, f"<w:r><w:rPr><w:b/></w:rPr>{_w_t(text)}</w:r>")
+    if align is not None:
+        p.alignment = align
+    return p
+
+
+def _resolve_bullet_style(doc: Document):
+    # Looked up once per Document: a paragraph created with a missing style is left behind
+    # in the body when the style setter raises, which used to print each bullet twice
+    if not hasattr(doc, "_torus_bullet_style"):
+        doc._torus_bullet_style = None
+        for style_name in ("List Bullet", "List Paragraph", "Bullet List"):
+            try:
+                doc._torus_bullet_style = doc.styles[style_name]
+                break
+            except KeyError:
+                continue
+    return doc._torus_bullet_style
 
 
 def add_bullet_paragraph(doc: Document, text: str):
-    # Template-safe bullet: try styles, fallback to manual bullet
-    for style_name in ("List Bullet", "List Paragraph", "Bullet List"):
-        try:
-            doc.add_paragraph(text, style=style_name)
-            return
-        except KeyError:
-            continue
-    doc.add_paragraph(f"• {text}")
+    # Template-safe bullet: first available list style, fallback to manual bullet
+    style = _resolve_bullet_style(doc)
+    if style is None:
+        _append(doc, f"• {text}")
+    elif _has_breaks(text):
+        _append(doc, text, style=style)
+    else:
+        # Same XML insert_paragraph_before(text, style) writes, without its style lookups
+        _append_xml(doc, BULLET_P_XML % (html.escape(style.style_id), _w_t(text)))
 
 
 def add_cover_page(doc: Document, client: str, body: str):
-    doc.add_paragraph(client)
-    doc.add_paragraph("")
-    doc.add_paragraph("Attn: ______________________")
-    doc.add_paragraph("")
-    doc.add_paragraph("Re: Janitorial Services Proposal")
-    doc.add_paragraph("")
-    doc.add_paragraph(f"Dear {client},")
-    doc.add_paragraph("")
-    doc.add_paragraph(body or "")
-    doc.add_paragraph("")
-    doc.add_paragraph("Respectfully,")
-    doc.add_paragraph("")
-    doc.add_paragraph("Kary Jubilee")
-    doc.add_paragraph("President")
-    doc.add_paragraph("Torus Cleaning Services")
-    doc.add_page_break()
-
-
-def add_scope_table(doc: Document, rows: List[tuple]):
+    _append(doc, client)
+    _append(doc, "")
+    _append(doc, "Attn: ______________________")
+    _append(doc, "")
+    _append(doc, "Re: Janitorial Services Proposal")
+    _append(doc, "")
+    _append(doc, f"Dear {client},")
+    _append(doc, "")
+    _append(doc, body or "")
+    _append(doc, "")
+    _append(doc, "Respectfully,")
+    _append(doc, "")
+    _append(doc, "Kary Jubilee")
+    _append(doc, "President")
+    _append(doc, "Torus Cleaning Services")
+    _append_page_break(doc)
+
+
+def add_scope_table(doc: Document, rows: Sequence[tuple]):
+    from docx.enum.table import WD_TABLE_ALIGNMENT
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls, qn
+    from docx.table import _Cell
+
     add_heading(doc, "SCOPE OF WORK – CLEANING SCHEDULE")
 
-    table = doc.add_table(rows=1, cols=4)
+    table = _append_table(doc, rows=0, cols=4)
     table.style = "Table Grid"
     table.alignment = WD_TABLE_ALIGNMENT.LEFT
 
-    hdr = table.rows[0].cells
-    hdr[0].text = "Task"
-    hdr[1].text = "Daily"
-    hdr[2].text = "Weekly"
-    hdr[3].text = "Monthly"
+    # Header and data rows are rendered to one XML string and inserted in a single extend;
+    # the cell.text setter rebuilds each cell's paragraph through python-docx
+    tbl = table._tbl
+    tcs = [
+        '<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="%s"/></w:tcPr><w:p><w:r>%%s</w:r></w:p></w:tc>' % gc.get(qn("w:w"))
+        for gc in tbl.tblGrid.gridCol_lst
+    ]
+    header = "<w:tr>" + "".join(tc % _w_t(col) for tc, col in zip(tcs, SCHEDULE_COLUMNS)) + "</w:tr>"
+    trs = "".join(
+        "<w:tr>"
+        + tcs[0] % ("" if _has_breaks(str(task)) else _w_t(str(task)))
+        + tcs[1] % CELL_XML[bool(daily)]
+        + tcs[2] % CELL_XML[bool(weekly)]
+        + tcs[3] % CELL_XML[bool(monthly)]
+        + "</w:tr>"
+        for task, daily, weekly, monthly in rows
+    )
+    tbl.extend(parse_xml(f"<w:tbl {nsdecls('w')}>{header}{trs}</w:tbl>"))
 
-    for task, daily, weekly, monthly in rows:
-        row = table.add_row().cells
-        row[0].text = str(task)
-        row[1].text = CHECK if bool(daily) else ""
-        row[2].text = CHECK if bool(weekly) else ""
-        row[3].text = CHECK if bool(monthly) else ""
+    # Tasks with tabs or line breaks go through the cell.text setter, which builds that run markup
+    tr_lst = None
+    for i, (task, *_) in enumerate(rows, start=1):
+        if _has_breaks(str(task)):
+            tr_lst = tr_lst or tbl.tr_lst
+            _Cell(tr_lst[i].tc_lst[0], table).text = str(task)
 
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_signature_blocks(doc: Document, contractor_name: str, contractor_title: str):
-    doc.add_paragraph("")
+    _append(doc, "")
     add_heading(doc, "SIGNATURES")
 
     # Contractor block
-    doc.add_paragraph("Date: ___________________")
-    doc.add_paragraph("__________________________________")
-    doc.add_paragraph("Contractor Signature")
-    doc.add_paragraph(f"Contractor Printed Name: {contractor_name}")
-    doc.add_paragraph(f"Title: {contractor_title}")
+    _append(doc, "Date: ___________________")
+    _append(doc, "__________________________________")
+    _append(doc, "Contractor Signature")
+    _append(doc, f"Contractor Printed Name: {contractor_name}")
+    _append(doc, f"Title: {contractor_title}")
 
-    doc.add_paragraph("")
+    _append(doc, "")
 
     # Client block (blank fields)
-    doc.add_paragraph("Date: ___________________")
-    doc.add_paragraph("__________________________________")
-    doc.add_paragraph("Client Signature")
-    doc.add_paragraph("Client Printed Name: _____________________________")
-    doc.add_paragraph("Client Title: ____________________________________")
+    _append(doc, "Date: ___________________")
+    _append(doc, "__________________________________")
+    _append(doc, "Client Signature")
+    _append(doc, "Client Printed Name: _____________________________")
+    _append(doc, "Client Title: ____________________________________")
 
 
 # =========================
@@ -243,23 +787,27 @@ def add_signature_blocks(doc: Document, contractor_name: str, contractor_title:
 # =========================
 def add_employee_conduct_section(doc: Document):
     add_heading(doc, "CONDUCT OF EMPLOYEES")
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Contractor shall be responsible for controlling employee conduct, for assuring that its employees are not boisterous or rude, "
         "and assuring that they are not engaging in any destructive or criminal activity. The Contractor is also responsible for assuring that "
         "its employees do not disturb papers on desks, open desk drawers, cabinets, briefcases, or use Client phones, except as authorized. "
         "The Contractor and its employees shall conduct themselves in a professional manner and not read newspapers, books, or similar items while at the job site. "
         "In addition, the Contractor’s employee shall not fraternize with Client’s employees while at the job site."
     )
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Client reserves the right to request the removal of any of the Contractor's employees from the building at any time. "
         "Such requests will be made to the Contractor’s supervisory personnel. At no time shall the Client assume the role of the supervisor of the Contractor's personnel."
     )
-    doc.add_paragraph(
+    _append(
+        doc,
         "Should the Client observe any action by the Contractor's personnel that requires correction, they shall immediately report the action to the Contractor's supervisor, "
         "who in turn shall take immediate corrective measures. In the event the Contractor's supervisor does not take immediate corrective measures, "
         "the Client shall exercise the option of requesting the removal of the offending Contractor's employee from property."
     )
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Client will make a written report of any occurrence of misconduct by the Contractor's employees to the Contract Administrator within twenty-four (24) hours of such an occurrence. "
         "It is agreed that any of the following actions by the Contractor's employee(s) shall be cause for removal. These include but are not limited to:"
     )
@@ -269,132 +817,155 @@ def add_employee_conduct_section(doc: Document):
     add_bullet_paragraph(doc, "Opening any drawers, cabinets, files, etc., or reading or removing any letters, documents, etc.")
     add_bullet_paragraph(doc, "Engaging in any loud, boisterous, or un-workmanlike conduct.")
     add_bullet_paragraph(doc, "Consuming food or beverage (other than water) in any area of the building other than the kitchen.")
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_on_site_storage_section(doc: Document):
     add_heading(doc, "ON-SITE STORAGE")
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Client will supply reasonable and suitable on-site storage space for such cleaning equipment and materials as the Contractor deems necessary for the performance of the Contract."
     )
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_compensation_section(doc: Document, amount: float, basis: str, net_terms_days: Optional[int]):
     add_heading(doc, "COMPENSATION")
 
     basis_norm = (basis or "").strip().lower()
-    basis_label = {
-        "annual": "annual",
-        "monthly": "monthly",
-        "per visit": "per visit",
-        "one-time clean": "one-time clean",
-    }.get(basis_norm, basis_norm or "annual")
-
-    invoice_sentence = {
-        "monthly": "The Client will be invoiced monthly in arrears.",
-        "annual": "The Client will be invoiced annually.",
-        "per visit": "The Client will be invoiced per visit upon completion of each visit.",
-        "one-time clean": "The Client will be invoiced upon completion of the Services.",
-    }.get(basis_norm, "The Client will be invoiced upon completion of the Services.")
-
-    doc.add_paragraph(
+    basis_label = basis_norm or "annual"
+    invoice_sentence = INVOICE_SENTENCES.get(basis_norm, DEFAULT_INVOICE_SENTENCE)
+
+    _append(
+        doc,
         f"The Contractor will charge a flat {basis_label} fee of ${amount:,.2f} for the Services listed within this Agreement. "
         "The Compensation includes sales tax and other applicable duties as may be required by law."
     )
-    doc.add_paragraph(invoice_sentence)
+    _append(doc, invoice_sentence)
 
     if net_terms_days is not None:
-        doc.add_paragraph(f"Invoices submitted by the Contractor to the Client are due within {int(net_terms_days)} days of receipt.")
+        _append(doc, f"Invoices submitted by the Contractor to the Client are due within {int(net_terms_days)} days of receipt.")
     else:
-        doc.add_paragraph("Invoices submitted by the Contractor to the Client are due within ____ days of receipt.")
+        _append(doc, "Invoices submitted by the Contractor to the Client are due within ____ days of receipt.")
 
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Contractor will be reimbursed for any expenses incurred in connection with providing the Services of this Agreement."
     )
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_interest_section(doc: Document, late_interest_percent: float):
     add_heading(doc, "INTEREST ON LATE PAYMENTS")
-    doc.add_paragraph(
+    _append(
+        doc,
         f"Interest payable on any overdue amounts under this Agreement is charged at the rate of {late_interest_percent:.2f}% (percent)."
     )
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_modification_section(doc: Document):
     add_heading(doc, "MODIFICATION OF AGREEMENT")
-    doc.add_paragraph(
+    _append(
+        doc,
         "Any amendment or modification of this Agreement or additional obligation assumed by either Party in connection with this Agreement will only be binding "
         "if evidenced in writing signed by each Party or an authorized representative of each Party."
     )
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_access_section(doc: Document):
     add_heading(doc, "ACCESS")
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Client agrees to provide the Contractor with the necessary access to the Property and all areas of the Property as defined within the Agreement."
     )
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 def add_cancellation_section(doc: Document):
     add_heading(doc, "CANCELLATION")
-    doc.add_paragraph(
+    _append(
+        doc,
         "This service agreement may be terminated at any time by the Client or Contractor upon mutual agreement."
     )
-    doc.add_paragraph(
+    _append(
+        doc,
         "The Client understands that the Contractor may terminate this agreement at any time if the Client fails to pay for the Services provided under this Agreement "
         "or if the Client breaches any other material provision listed in this Cleaning Services Agreement. Client agrees to pay any outstanding balances within (10) ten days of termination."
     )
-    doc.add_paragraph("")
+    _append(doc, "")
 
 
 # =========================
 # BUILD WORD DOC
 # =========================
-def build_doc(p: ProposalInputs, schedule_rows: List[tuple]) -> bytes:
-    doc = Document(TEMPLATE_FILE) if os.path.exists(TEMPLATE_FILE) else Document()
+@st.cache_resource(show_spinner=False, max_entries=4)
+def template_document(path: Optional[str], mtime: float) -> Document:
+    # Parsed once per file version and never modified; each proposal works on a deep copy.
+    # mtime is only part of the cache key, so replacing the template on disk is picked up.
+    # No path means python-docx's built-in blank template.
+    from docx import Document
+
+    if path is None:
+        return Document()
+    with open(path, "rb") as f:
+        return Document(BytesIO(f.read()))
+
+
+def template_version() -> tuple:
+    """(path, mtime) of the template file, or (None, 0.0) for the built-in blank template."""
+    # One stat gives both existence and the cache key
+    try:
+        return TEMPLATE_FILE, os.stat(TEMPLATE_FILE).st_mtime
+    except OSError:
+        return None, 0.0
+
+
+def build_doc(p: ProposalInputs, schedule_rows: Sequence[tuple], template: Optional[tuple] = None) -> bytes:
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    # Copying the parsed package is about twice as fast as unzipping and re-parsing every part
+    doc = copy.deepcopy(template_document(*(template or template_version())))
 
     for s in doc.sections:
-        s.different_first_page_header_footer = False
+        if s.different_first_page_header_footer:
+            s.different_first_page_header_footer = False
 
     if p.include_cover_page:
         client_for_letter = p.client.strip() if p.client.strip() else "[Client Name]"
         add_cover_page(doc, client_for_letter, p.cover_letter_body)
 
     # Title
-    title = doc.add_paragraph("CLEANING SERVICE AGREEMENT")
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    (title.runs[0] if title.runs else title.add_run("CLEANING SERVICE AGREEMENT")).bold = True
+    add_heading(doc, "CLEANING SERVICE AGREEMENT", align=WD_ALIGN_PARAGRAPH.CENTER)
 
     # Client fields
-    doc.add_paragraph(f"Client: {p.client}")
-    doc.add_paragraph(f"Facility: {p.facility_name}")
+    _append(doc, f"Client: {p.client}")
+    _append(doc, f"Facility: {p.facility_name}")
 
     # Addresses
-    doc.add_paragraph("Service Address(es):")
+    _append(doc, "Service Address(es):")
     for a in (p.service_addresses or []):
         a2 = (a or "").strip()
         if a2:
             add_bullet_paragraph(doc, a2)
-    doc.add_paragraph("")
+    _append(doc, "")
 
     # Agreement paragraphs (date blank)
     client_name = p.client.strip() if p.client.strip() else "[Client Name]"
     first_addr = (p.service_addresses[0] if p.service_addresses else "[service address]")
-    doc.add_paragraph(
+    _append(
+        doc,
         f"{client_name}, (‘Client’), enters into this agreement on this date ______________ "
         f"for Torus Cleaning Services (‘Contractor’), to provide janitorial services for facility/facilities located at the following locations: {first_addr}"
     )
-    doc.add_paragraph(
+    _append(
+        doc,
         f"Contractor shall provide janitorial services {p.days_per_week} per week between the hours of {p.cleaning_times} "
         f"for the facility/facilities located at {first_addr}."
     )
-    doc.add_paragraph(f"The contract period is as follows {p.service_begin_date} to {p.service_end_date}.")
-    doc.add_paragraph("")
+    _append(doc, f"The contract period is as follows {p.service_begin_date} to {p.service_end_date}.")
+    _append(doc, "")
 
     # Room counts (FIXED: no zeros, no duplicates)
     add_heading(doc, "ROOM COUNTS")
@@ -436,9 +1007,9 @@ def build_doc(p: ProposalInputs, schedule_rows: List[tuple]) -> bytes:
         printed_any = True
 
     if not printed_any:
-        doc.add_paragraph("(none)")
+        _append(doc, "(none)")
 
-    doc.add_paragraph("")
+    _append(doc, "")
 
     # Scope table
     add_scope_table(doc, schedule_rows)
@@ -446,15 +1017,12 @@ def build_doc(p: ProposalInputs, schedule_rows: List[tuple]) -> bytes:
     # Cleaning plan
     if (p.cleaning_plan or "").strip():
         add_heading(doc, "CLEANING PLAN")
-        doc.add_paragraph(p.cleaning_plan.strip())
-        doc.add_paragraph("")
+        _append(doc, p.cleaning_plan.strip())
+        _append(doc, "")
 
     # General requirements
     add_heading(doc, "GENERAL REQUIREMENTS")
-    doc.add_paragraph(
-        "Contractor shall provide all labor, supervision, and personnel necessary to perform the services described in this agreement. "
-        "Unless otherwise stated, Contractor shall provide all standard equipment and cleaning supplies."
-    )
+    _append(doc, GENERAL_REQUIREMENTS_TEXT)
 
     consumables_lines = []
     if p.hand_soap:
@@ -465,12 +1033,12 @@ def build_doc(p: ProposalInputs, schedule_rows: List[tuple]) -> bytes:
         consumables_lines.append(f"Toilet paper: {p.toilet_paper}")
 
     if consumables_lines:
-        doc.add_paragraph("")
-        doc.add_paragraph("Consumable supplies:")
+        _append(doc, "")
+        _append(doc, "Consumable supplies:")
         for line in consumables_lines:
-            doc.add_paragraph(f"• {line}")
+            _append(doc, f"• {line}")
 
-    doc.add_paragraph("")
+    _append(doc, "")
 
     # Contract sections
     if p.include_employee_conduct:
@@ -497,16 +1065,27 @@ def build_doc(p: ProposalInputs, schedule_rows: List[tuple]) -> bytes:
     # Notes (FIXED: only print if notes has input)
     if (p.notes or "").strip():
         add_heading(doc, "NOTES")
-        doc.add_paragraph(p.notes.strip())
+        _append(doc, p.notes.strip())
 
     # Signatures
     add_signature_blocks(doc, p.contractor_printed_name, p.contractor_title)
 
+    _remove_sentinel(doc)
     bio = BytesIO()
     doc.save(bio)
     return bio.getvalue()
 
 
+@st.cache_data(
+    show_spinner=False,
+    max_entries=16,
+    hash_funcs={ProposalInputs: lambda p: inputs_json(p, sort_keys=True)},
+)
+def build_doc_cached(p: ProposalInputs, schedule_rows: tuple, template: tuple) -> bytes:
+    # Generating again with unchanged inputs and an unchanged template file reuses the previous .docx
+    return build_doc(p, schedule_rows, template)
+
+
 # =========================
 # PRINT PREVIEW HELPERS (HTML)
 # =========================
@@ -514,10 +1093,14 @@ def _esc(x: str) -> str:
     return html.escape(x or "")
 
 def schedule_rows_to_html_table(rows: List[tuple]) -> str:
-    df = pd.DataFrame(rows, columns=["Task", "Daily", "Weekly", "Monthly"]).copy()
-    for col in ["Daily", "Weekly", "Monthly"]:
-        df[col] = df[col].apply(lambda v: CHECK if bool(v) else "")
-    return df.to_html(index=False, escape=True)
+    head = "".join(f"<th>{c}</th>" for c in SCHEDULE_COLUMNS)
+    body = "".join(
+        f"<tr><td>{_esc(str(task))}</td>"
+        + "".join(f"<td>{CELL[bool(v)]}</td>" for v in (daily, weekly, monthly))
+        + "</tr>"
+        for task, daily, weekly, monthly in rows
+    )
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
 
 def build_print_preview_html(li: dict) -> str:
     client = _esc(li.get("client", ""))
@@ -564,12 +1147,7 @@ def build_print_preview_html(li: dict) -> str:
     late_interest = pay.get("late_interest")
 
     basis_norm = basis.lower()
-    invoice_sentence = {
-        "monthly": "The Client will be invoiced monthly in arrears.",
-        "annual": "The Client will be invoiced annually.",
-        "per visit": "The Client will be invoiced per visit upon completion of each visit.",
-        "one-time clean": "The Client will be invoiced upon completion of the Services.",
-    }.get(basis_norm, "The Client will be invoiced upon completion of the Services.")
+    invoice_sentence = INVOICE_SENTENCES.get(basis_norm, DEFAULT_INVOICE_SENTENCE)
 
     # Schedule
     schedule_rows = li.get("schedule_rows", []) or []
@@ -662,8 +1240,7 @@ def build_print_preview_html(li: dict) -> str:
       {cleaning_plan_html}
 
       <h3>GENERAL REQUIREMENTS</h3>
-      <p>Contractor shall provide all labor, supervision, and personnel necessary to perform the services described in this agreement.
-      Unless otherwise stated, Contractor shall provide all standard equipment and cleaning supplies.</p>
+      <p>{GENERAL_REQUIREMENTS_TEXT}</p>
 
       <p><b>Consumable supplies:</b></p>
       {consumables_html}
@@ -707,106 +1284,112 @@ st.title("Torus Group – Cleaning Proposal Builder")
 
 # Session defaults
 st.session_state.setdefault("ai", None)
+st.session_state.setdefault("batches", [])
 st.session_state.setdefault("cover_body_custom", "")
-st.session_state.setdefault("custom_rooms", [{"type": "", "count": 0}])
+st.session_state.setdefault("custom_room_rows", 1)
+st.session_state.setdefault("generated", None)
 st.session_state.setdefault("last_inputs", None)
-st.session_state.setdefault(
-    "schedule_df",
-    pd.DataFrame(
-        [
-            ("Empty trash & replace liners", True, False, False),
-            ("Clean & disinfect restrooms", True, False, False),
-            ("Vacuum carpet / sweep hard floors", True, False, False),
-            ("Wipe high-touch points (handles, switches)", True, False, False),
-            ("Dust reachable surfaces", False, True, False),
-            ("Mop hard floors (as applicable)", False, True, False),
-            ("Clean break room counters & sink", False, True, False),
-            ("Glass/mirrors touch-up", False, True, False),
-            ("High dusting (vents/ledges)", False, False, True),
-            ("Detail baseboards/edges", False, False, True),
-        ],
-        columns=["Task", "Daily", "Weekly", "Monthly"],
-    ),
-)
+st.session_state.setdefault("preview_html", None)
+# Schedule rows are plain dicts: st.data_editor edits a list of records directly.
+# Built only for a new session; each session gets its own dicts since the editor output replaces them.
+if "schedule" not in st.session_state:
+    st.session_state["schedule"] = [dict(zip(SCHEDULE_COLUMNS, row)) for row in DEFAULT_SCHEDULE_ROWS]
+
+def add_room_row():
+    st.session_state["custom_room_rows"] += 1
+
+
+def remove_room_row():
+    n = st.session_state["custom_room_rows"]
+    if n > 1:
+        st.session_state["custom_room_rows"] = n - 1
+        # Forget the removed row's values so a re-added row starts blank
+        st.session_state.pop(f"crtype_{n - 1}", None)
+        st.session_state.pop(f"crcount_{n - 1}", None)
+
+
+def collect_custom_rooms() -> List[Dict[str, Any]]:
+    # The keyed widgets own the values; this reads them back as {"type", "count"} rows
+    ss = st.session_state
+    return [
+        {"type": str(ss.get(f"crtype_{i}", "")), "count": int(ss.get(f"crcount_{i}", 0) or 0)}
+        for i in range(ss["custom_room_rows"])
+    ]
+
+
+@st.fragment
+def custom_rooms_editor():
+    # A fragment outside the form: adding, removing or editing a row reruns only this section
+    st.subheader("Additional Room Types (Name + Count)")
+    st.caption("Rows with blank name or 0 count will not print.")
+    rb1, rb2, _ = st.columns([1, 1, 2])
+    with rb1:
+        st.button("➕ Add room row", on_click=add_room_row)
+    with rb2:
+        st.button("➖ Remove last room row", on_click=remove_room_row)
+
+    for i in range(st.session_state["custom_room_rows"]):
+        rc1, rc2 = st.columns([3, 1])
+        with rc1:
+            st.text_input("Room type name", placeholder="e.g., Exam Rooms", key=f"crtype_{i}")
+        with rc2:
+            st.number_input("Count", min_value=0, step=1, key=f"crcount_{i}")
+
+
+def add_schedule_row():
+    # Runs before the script, so the editor below already includes the new row; no st.rerun needed
+    st.session_state["schedule"].append(dict(zip(SCHEDULE_COLUMNS, ("", False, False, False))))
+
 
 # iPad-friendly buttons (outside the form)
-top1, top2, top3, top4 = st.columns([1, 1, 1, 2])
+top1, top2 = st.columns([1, 3])
 with top1:
-    if st.button("➕ Add room row"):
-        st.session_state["custom_rooms"].append({"type": "", "count": 0})
-        st.rerun()
+    st.button("🧹 Add schedule row", on_click=add_schedule_row)
 with top2:
-    if st.button("➖ Remove last room row"):
-        if len(st.session_state["custom_rooms"]) > 1:
-            st.session_state["custom_rooms"].pop()
-            st.rerun()
-with top3:
-    if st.button("🧹 Add schedule row"):
-        df = st.session_state["schedule_df"]
-        df.loc[len(df)] = ["", False, False, False]
-        st.session_state["schedule_df"] = df
-        st.rerun()
-with top4:
     st.caption(f"Template found: {os.path.exists(TEMPLATE_FILE)}  |  Template file: {TEMPLATE_FILE}")
 
+custom_rooms_editor()
+
 with st.form("proposal_form", clear_on_submit=False):
     st.subheader("Client & Contract")
     c1, c2, c3 = st.columns(3)
     with c1:
-        client = st.text_input("Client", value="")
-        facility = st.text_input("Facility name", value="")
+        client = st.text_input("Client", value="", key="client")
+        facility = st.text_input("Facility name", value="", key="facility")
     with c2:
-        service_begin_date = st.text_input("Service begin date", value="")
-        service_end_date = st.text_input("Service end date", value="")
+        service_begin_date = st.text_input("Service begin date", value="", key="service_begin_date")
+        service_end_date = st.text_input("Service end date", value="", key="service_end_date")
     with c3:
-        days = st.number_input("Days per week", min_value=1, value=5)
-        times = st.text_input("Cleaning times (e.g., 6 PM – 10 PM)", value="")
+        days = st.number_input("Days per week", min_value=1, value=5, key="days_per_week")
+        times = st.text_input("Cleaning times (e.g., 6 PM – 10 PM)", value="", key="cleaning_times")
 
     st.subheader("Service Addresses")
-    addresses_text = st.text_area("One address per line", height=110)
+    addresses_text = st.text_area("One address per line", height=110, key="addresses")
 
     st.subheader("Room Counts (Standard)")
     r1, r2, r3, r4 = st.columns(4)
     with r1:
-        offices = st.number_input("Offices", min_value=0, value=0)
+        offices = st.number_input("Offices", min_value=0, value=0, key="num_offices")
     with r2:
-        conference = st.number_input("Conference rooms", min_value=0, value=0)
+        conference = st.number_input("Conference rooms", min_value=0, value=0, key="num_conference_rooms")
     with r3:
-        breaks = st.number_input("Break rooms", min_value=0, value=0)
+        breaks = st.number_input("Break rooms", min_value=0, value=0, key="num_break_rooms")
     with r4:
-        baths = st.number_input("Bathrooms", min_value=0, value=0)
-
-    st.subheader("Additional Room Types (Name + Count)")
-    st.caption("Rows with blank name or 0 count will not print.")
-    for i, room in enumerate(st.session_state["custom_rooms"]):
-        rc1, rc2 = st.columns([3, 1])
-        with rc1:
-            st.session_state["custom_rooms"][i]["type"] = st.text_input(
-                f"custom_room_type_{i}",
-                value=str(room.get("type", "")),
-                placeholder="e.g., Exam Rooms",
-            )
-        with rc2:
-            st.session_state["custom_rooms"][i]["count"] = st.number_input(
-                f"custom_room_count_{i}",
-                min_value=0,
-                step=1,
-                value=int(room.get("count", 0) or 0),
-            )
+        baths = st.number_input("Bathrooms", min_value=0, value=0, key="num_bathrooms")
 
     st.subheader("Consumables (Optional)")
     st.caption("Leave blank if not included. Only selected items will appear in the agreement.")
     cA, cB, cC = st.columns(3)
     with cA:
-        hand_soap = st.selectbox("Hand soap", ["(leave blank)", "Contractor", "Client"], index=0)
+        hand_soap = st.selectbox("Hand soap", ["(leave blank)", "Contractor", "Client"], index=0, key="hand_soap")
     with cB:
-        paper_towels = st.selectbox("Paper towels", ["(leave blank)", "Contractor", "Client"], index=0)
+        paper_towels = st.selectbox("Paper towels", ["(leave blank)", "Contractor", "Client"], index=0, key="paper_towels")
     with cC:
-        toilet_paper = st.selectbox("Toilet paper", ["(leave blank)", "Contractor", "Client"], index=0)
+        toilet_paper = st.selectbox("Toilet paper", ["(leave blank)", "Contractor", "Client"], index=0, key="toilet_paper")
 
     st.subheader("Cover Page")
-    include_cover = st.checkbox("Include cover page", value=True)
-    use_standard_cover = st.checkbox("Use Torus standard cover letter", value=True)
+    include_cover = st.checkbox("Include cover page", value=True, key="include_cover_page")
+    use_standard_cover = st.checkbox("Use Torus standard cover letter", value=True, key="use_standard_cover")
     if use_standard_cover:
         cover_body = default_cover_letter(client)
         st.text_area("Cover letter (preview)", value=cover_body, height=220, disabled=True)
@@ -816,41 +1399,51 @@ with st.form("proposal_form", clear_on_submit=False):
     st.subheader("Contract Sections (On by default)")
     s1, s2, s3 = st.columns(3)
     with s1:
-        include_employee_conduct = st.checkbox("Employee Conduct", value=True)
-        include_on_site_storage = st.checkbox("On-Site Storage", value=True)
+        include_employee_conduct = st.checkbox("Employee Conduct", value=True, key="include_employee_conduct")
+        include_on_site_storage = st.checkbox("On-Site Storage", value=True, key="include_on_site_storage")
     with s2:
-        include_compensation_section = st.checkbox("Compensation / Late Interest", value=True)
-        include_modification = st.checkbox("Modification of Agreement", value=True)
+        include_compensation_section = st.checkbox("Compensation / Late Interest", value=True, key="include_compensation_section")
+        include_modification = st.checkbox("Modification of Agreement", value=True, key="include_modification")
     with s3:
-        include_access = st.checkbox("Access", value=True)
-        include_cancellation = st.checkbox("Cancellation", value=True)
+        include_access = st.checkbox("Access", value=True, key="include_access")
+        include_cancellation = st.checkbox("Cancellation", value=True, key="include_cancellation")
 
     st.subheader("Payment (Optional)")
     st.caption("Compensation/Interest prints only if you enter a Compensation amount.")
     pay1, pay2, pay3, pay4 = st.columns([1, 1, 1, 1])
     with pay1:
-        amount = st.text_input("Compensation amount (numbers only)", value="")
+        amount = st.text_input("Compensation amount (numbers only)", value="", key="compensation_amount")
     with pay2:
-        basis = st.selectbox("Basis", ["monthly", "annual", "per visit", "one-time clean"], index=0)
+        basis = st.selectbox("Basis", ["monthly", "annual", "per visit", "one-time clean"], index=0, key="compensation_basis")
     with pay3:
-        net_terms = st.selectbox("Net terms (days)", ["(leave blank)", "15", "30", "45", "60"], index=2)
+        net_terms = st.selectbox("Net terms (days)", ["(leave blank)", "15", "30", "45", "60"], index=2, key="net_terms")
     with pay4:
-        late_interest = st.text_input("Late interest % (optional)", value="")
+        late_interest = st.text_input("Late interest % (optional)", value="", key="late_interest")
 
     st.subheader("Cleaning Plan & Notes")
-    cleaning_plan = st.text_area("Cleaning Plan (optional)", height=120)
-    notes = st.text_area("Notes", height=110)
+    cleaning_plan = st.text_area("Cleaning Plan (optional)", height=120, key="cleaning_plan")
+    notes = st.text_area("Notes", height=110, key="notes")
 
     st.subheader("Cleaning Schedule")
-    schedule_df = st.data_editor(
-        st.session_state["schedule_df"],
+    schedule_edit = st.data_editor(
+        st.session_state["schedule"],
         num_rows="dynamic",
         use_container_width=True,
         height=320,
     )
 
     st.subheader("RFP / PWS Analyzer (Optional)")
-    uploads = st.file_uploader("Upload RFP/PWS", type=["pdf", "docx", "txt"], accept_multiple_files=True)
+    uploads = st.file_uploader("Upload RFP/PWS", type=["pdf", "docx", "txt"], accept_multiple_files=True, key="rfp_uploads")
+    queue_batch = st.checkbox("Queue as batch (about half the cost, results within 24 hours)", value=False, key="queue_batch")
+    rfp_token_budget = st.number_input(
+        "RFP token budget per request",
+        min_value=2000,
+        max_value=MAX_RFP_TOKEN_BUDGET,
+        value=MAX_RFP_TOKENS,
+        step=1000,
+        help="Longer RFPs are cut to this many tokens. Smaller budgets answer faster and cost less.",
+        key="rfp_token_budget",
+    )
 
     a1, a2, a3 = st.columns([1, 1, 1])
     with a1:
@@ -861,7 +1454,8 @@ with st.form("proposal_form", clear_on_submit=False):
         generate_btn = st.form_submit_button("Generate Proposal")
 
 # Persist edits
-st.session_state["schedule_df"] = schedule_df
+# An empty list has no columns, so keep one blank row for the editor to add from
+st.session_state["schedule"] = schedule_edit or [dict(zip(SCHEDULE_COLUMNS, ("", False, False, False)))]
 if not use_standard_cover:
     st.session_state["cover_body_custom"] = cover_body
 
@@ -875,9 +1469,9 @@ addresses = [x.strip() for x in (addresses_text or "").splitlines() if x.strip()
 
 # Convert schedule rows
 schedule_rows = [
-    (str(r.Task).strip(), bool(r.Daily), bool(r.Weekly), bool(r.Monthly))
-    for r in st.session_state["schedule_df"].itertuples()
-    if str(r.Task).strip()
+    (str(r.get("Task") or "").strip(), bool(r.get("Daily")), bool(r.get("Weekly")), bool(r.get("Monthly")))
+    for r in st.session_state["schedule"]
+    if str(r.get("Task") or "").strip()
 ]
 
 def parse_float_or_none(x: str) -> Optional[float]:
@@ -893,9 +1487,10 @@ comp_amount = parse_float_or_none(amount)
 late_interest_val = parse_float_or_none(late_interest)
 net_terms_val = None if net_terms == "(leave blank)" else int(net_terms)
 
-# Store preview inputs
+# Store preview inputs; any submit invalidates the last generated files
 if update_preview_btn or analyze_btn or generate_btn:
-    st.session_state["last_inputs"] = {
+    st.session_state["generated"] = None
+    li = {
         "client": client,
         "facility": facility,
         "begin": service_begin_date,
@@ -907,7 +1502,7 @@ if update_preview_btn or analyze_btn or generate_btn:
         "conference": int(conference),
         "breaks": int(breaks),
         "baths": int(baths),
-        "custom_rooms": st.session_state.get("custom_rooms", []),
+        "custom_rooms": collect_custom_rooms(),
         "consumables": {"hand_soap": hand_soap_val, "paper_towels": paper_towels_val, "toilet_paper": toilet_paper_val},
         "include_cover": bool(include_cover),
         "use_standard_cover": bool(use_standard_cover),
@@ -925,6 +1520,11 @@ if update_preview_btn or analyze_btn or generate_btn:
         },
         "schedule_rows": schedule_rows,
     }
+    # The preview HTML is rebuilt only when a submit actually changed the inputs;
+    # every other rerun (AI results, batches, downloads) reuses the stored copy
+    if li != st.session_state["last_inputs"]:
+        st.session_state["last_inputs"] = li
+        st.session_state["preview_html"] = build_print_preview_html(li)
 
 # =========================
 # PREVIEW
@@ -932,8 +1532,8 @@ if update_preview_btn or analyze_btn or generate_btn:
 st.divider()
 st.subheader("Preview")
 
-li = st.session_state.get("last_inputs")
-if not li:
+preview_html = st.session_state["preview_html"]
+if not preview_html:
     st.info("Fill out the form and press **Update Preview** to see the print preview.")
 else:
     st.markdown(
@@ -983,7 +1583,7 @@ else:
         """,
         unsafe_allow_html=True,
     )
-    st.markdown(build_print_preview_html(li), unsafe_allow_html=True)
+    st.markdown(preview_html, unsafe_allow_html=True)
 
 # =========================
 # AI ANALYSIS
@@ -993,16 +1593,123 @@ if analyze_btn:
         st.error("Please upload at least one RFP/PWS file.")
     else:
         try:
-            full_text = "\n\n".join(extract_text(f) for f in uploads)
-            if not full_text.strip():
+            # Read uploads on the main thread, then parse them in parallel
+            names = [f.name for f in uploads]
+            # getvalue() hands back the upload's own buffer (no copy) regardless of stream position
+            datas = [f.getvalue() for f in uploads]
+            # The same file uploaded twice is parsed once
+            jobs = {}
+            for n, data in zip(names, datas):
+                jobs.setdefault(file_digest(data), (n, data))
+            # Bounded pool: one worker per distinct file, at most 8
+            with script_thread_pool(max_workers=min(8, len(jobs))) as ex:
+                texts = list(ex.map(lambda d: extract_text_cached(jobs[d][0], d, jobs[d][1]), jobs))
+            for (n, _), t in zip(jobs.values(), texts):
+                if PDF_TIMEOUT_MARKER in t:
+                    st.warning(f"{n}: text extraction timed out, so only the first pages will be analyzed.")
+            doc_texts, rfp_key = prepare_rfp_texts(texts)
+            budget = int(rfp_token_budget)
+            tokens = rfp_token_count(doc_texts) if doc_texts else None
+            if tokens is not None:
+                st.caption(f"RFP text: {tokens:,} tokens; each request is cut to {budget:,}.")
+            if not doc_texts:
                 st.error("Could not extract text from the upload(s). If PDF is scanned, OCR is needed.")
+            elif queue_batch:
+                with st.spinner("Submitting batch…"):
+                    batch_id = submit_rfp_batch(doc_texts, budget)
+                st.session_state["batches"].append(
+                    {
+                        "id": batch_id,
+                        "files": names,
+                        "texts": doc_texts,
+                        "key": rfp_key,
+                        "max_tokens": budget,
+                        "submitted": time.time(),
+                    }
+                )
+                st.success(f"Queued batch {batch_id}. Use **Check status** below to load the results.")
             else:
-                with st.spinner("Analyzing…"):
-                    st.session_state["ai"] = analyze_rfp_with_ai(full_text)
+                # Analyze in a worker and show the drafts as the streamed JSON arrives
+                progress = {"parts": []}
+                # One placeholder per field, each redrawn only when its own text changes
+                live = st.empty()
+                field_phs = {
+                    "cleaning_plan_draft": ("Cleaning plan", st.empty()),
+                    "scope_of_work_draft": ("Scope of work", st.empty()),
+                }
+                drawn = {}
+                with st.spinner("Analyzing…"), script_thread_pool(max_workers=1) as ex:
+                    fut = ex.submit(
+                        analyze_rfp_with_ai_cached,
+                        rfp_key,
+                        tuple(doc_texts),
+                        _on_delta=lambda parts: progress.update(parts=parts),
+                        max_tokens=budget,
+                    )
+                    shown = progress["parts"]
+                    while not fut.done():
+                        # Only redraw when new text has arrived (on_delta swaps in a new list)
+                        if progress["parts"] is not shown:
+                            shown = progress["parts"]
+                            draft = partial_ai_result(shown)
+                            if draft is None:
+                                live.code("\n".join(shown)[-500:], language="json")
+                            else:
+                                live.caption(
+                                    f"Receiving… {len(draft['schedule_rows'])} schedule rows, "
+                                    f"{len(draft['clarifying_questions'])} questions so far"
+                                )
+                                for field, (label, ph) in field_phs.items():
+                                    text = draft[field][-1500:]
+                                    if text and text != drawn.get(field):
+                                        drawn[field] = text
+                                        ph.text(f"{label}:\n{text}")
+                        time.sleep(0.25)
+                live.empty()
+                for _, ph in field_phs.values():
+                    ph.empty()
+                st.session_state["ai"] = fut.result()
                 st.success("AI analysis complete.")
         except Exception as e:
             st.exception(e)
 
+@st.fragment
+def queued_batches():
+    # A fragment: checking a batch that is still running reruns only this section
+    st.divider()
+    st.subheader("Queued AI Batches")
+    for b in list(st.session_state["batches"]):
+        bc1, bc2 = st.columns([3, 1])
+        with bc1:
+            st.write(f"**{b['id']}** — {', '.join(b['files'])}")
+        with bc2:
+            check_batch = st.button("Check status", key=f"check_{b['id']}")
+        if check_batch:
+            try:
+                status, result = fetch_rfp_batch(b["id"])
+                overdue = time.time() - b["submitted"] > BATCH_FALLBACK_MINUTES * 60
+                if result is None and (overdue or status not in BATCH_PENDING_STATUSES):
+                    # Batch failed/expired or is taking too long: run the analysis now instead
+                    if status in BATCH_PENDING_STATUSES:
+                        get_openai_client().batches.cancel(b["id"])
+                    with st.spinner("Batch not finished — analyzing now…"):
+                        result = analyze_rfp_with_ai_cached(
+                            b["key"], tuple(b["texts"]), max_tokens=b["max_tokens"]
+                        )
+                if result is None:
+                    st.info(f"Batch {b['id']} status: {status}")
+                else:
+                    st.session_state["ai"] = result
+                    st.session_state["batches"].remove(b)
+                    # Full rerun so the AI Results section below picks up the new result
+                    st.rerun(scope="app")
+            except Exception as e:
+                st.exception(e)
+
+
+if st.session_state["batches"]:
+    queued_batches()
+
 if st.session_state.get("ai"):
     ai = st.session_state["ai"]
     st.divider()
@@ -1024,7 +1731,7 @@ if st.session_state.get("ai"):
                 continue
             rows.append((task, bool(r.get("daily")), bool(r.get("weekly")), bool(r.get("monthly"))))
         if rows:
-            st.session_state["schedule_df"] = pd.DataFrame(rows, columns=["Task", "Daily", "Weekly", "Monthly"])
+            st.session_state["schedule"] = [dict(zip(SCHEDULE_COLUMNS, row)) for row in rows]
             st.success("Applied AI schedule. Scroll up—your schedule table is updated.")
             st.rerun()
         else:
@@ -1048,7 +1755,7 @@ if generate_btn:
         num_break_rooms=int(breaks),
         num_bathrooms=int(baths),
 
-        custom_rooms=st.session_state.get("custom_rooms", []),
+        custom_rooms=collect_custom_rooms(),
 
         hand_soap=hand_soap_val,
         paper_towels=paper_towels_val,
@@ -1076,19 +1783,29 @@ if generate_btn:
         contractor_title="President, Torus Cleaning Services",
     )
 
-    docx_bytes = build_doc(p, schedule_rows)
-
+    # Kept in session state so the download buttons survive later reruns (room edits, AI, batches).
+    # Built here rather than lazily in the button, so errors show up on Generate, not as a broken download.
+    st.session_state["generated"] = {
+        "docx": build_doc_cached(p, tuple(schedule_rows), template_version()),
+        "json": inputs_json(p, indent=True),
+    }
     st.success("Proposal generated.")
+
+generated = st.session_state["generated"]
+if generated:
+    today = datetime.date.today().isoformat()
     st.download_button(
         "Download Word Proposal",
-        data=docx_bytes,
-        file_name=f"Torus_Cleaning_Agreement_{datetime.date.today().isoformat()}.docx",
+        data=generated["docx"],
+        file_name=f"Torus_Cleaning_Agreement_{today}.docx",
         mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        on_click="ignore",
     )
 
     st.download_button(
         "Download Inputs (JSON)",
-        data=json.dumps(asdict(p), indent=2).encode("utf-8"),
-        file_name=f"Torus_Inputs_{datetime.date.today().isoformat()}.json",
+        data=generated["json"],
+        file_name=f"Torus_Inputs_{today}.json",
         mime="application/json",
+        on_click="ignore",
     )